@@ -1,14 +1,349 @@
 #!/usr/bin/env python3
 """ Expiring web cache module """
 
-from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from functools import lru_cache, wraps
+import gzip
+import hashlib
+import re
+from threading import Event, Thread
+import time
 import redis
 import requests
-from typing import Callable
+from requests.adapters import HTTPAdapter
+from typing import Callable, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from urllib3.util.retry import Retry
 
 # Initialize Redis client connection
 r = redis.Redis()
 
+# Per-attempt timeout and retries for upstream fetches
+FETCH_TIMEOUT = 30
+FETCH_RETRIES = 2
+FETCH_BACKOFF_FACTOR = 0.3
+
+# Shared HTTP session so keep-alive connections are reused across fetches
+_SESSION = requests.Session()
+_ADAPTER = HTTPAdapter(pool_connections=32, pool_maxsize=64,
+                       max_retries=Retry(total=FETCH_RETRIES,
+                                         backoff_factor=FETCH_BACKOFF_FACTOR,
+                                         status_forcelist=[502, 503, 504],
+                                         # Retry-After may ask for hours
+                                         respect_retry_after_header=False))
+_SESSION.mount('http://', _ADAPTER)
+_SESSION.mount('https://', _ADAPTER)
+
+# Lifetime used when the server does not declare one
+CACHE_EXPIRATION_TIME = 10
+
+# How long validators and the last body are kept for revalidation
+REVALIDATION_WINDOW = 3600
+
+# Sorted set of cached URLs scored by last access, used for LRU eviction
+LRU_KEY = "lru:pages"
+MAX_CACHED_PAGES = 1024
+
+# Upper bound on simultaneous upstream fetches in get_pages
+MAX_CONCURRENT_FETCHES = 16
+
+# Single-flight lock held while one caller fetches a missing page. A
+# fetch has no overall time limit, so the lock is renewed while it runs
+# and only expires early if its holder dies.
+FETCH_LOCK_TIMEOUT = 10
+FETCH_POLL_INTERVAL = 0.05
+
+# How long failed fetches are remembered (404s are unlikely to recover)
+NEGATIVE_CACHE_TIME = 2
+NEGATIVE_CACHE_TIME_NOT_FOUND = 60
+
+# Page bodies are stored once per digest under body:<digest>. Each URL
+# holding a body is one reference to it; the body is deleted when the
+# last URL referencing it is dropped.
+BODY_URLS_KEY = "bodies:urls"
+BODY_REFS_KEY = "bodies:refs"
+
+# Lua helper releasing the body held by a URL (KEYS[1], KEYS[2] above)
+_RELEASE_BODY = """
+local function release(url)
+    local digest = redis.call('HGET', KEYS[1], url)
+    if not digest then
+        return
+    end
+    redis.call('HDEL', KEYS[1], url)
+    if redis.call('HINCRBY', KEYS[2], digest, -1) <= 0 then
+        redis.call('HDEL', KEYS[2], digest)
+        redis.call('DEL', 'body:' .. digest)
+    end
+end
+"""
+
+# Point a URL (ARGV[1]) at a body (ARGV[2], compressed as ARGV[3]). The
+# body is written back even when already referenced, in case Redis
+# evicted it under maxmemory.
+_STORE_BODY = r.register_script(_RELEASE_BODY + """
+redis.call('SET', 'body:' .. ARGV[2], ARGV[3], 'NX')
+if redis.call('HGET', KEYS[1], ARGV[1]) == ARGV[2] then
+    return
+end
+release(ARGV[1])
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('HINCRBY', KEYS[2], ARGV[2], 1)
+""")
+
+# Drop cached URLs (ARGV) from the cache and the LRU set (KEYS[3])
+_DROP_PAGES = r.register_script(_RELEASE_BODY + """
+for _, url in ipairs(ARGV) do
+    redis.call('ZREM', KEYS[3], url)
+    redis.call('DEL', 'cache:' .. url, 'meta:' .. url)
+    release(url)
+end
+""")
+
+# Drop URLs last used before ARGV[1] and return how many remain
+_TRIM_PAGES = r.register_script(_RELEASE_BODY + """
+local stale = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[1])
+for _, url in ipairs(stale) do
+    redis.call('ZREM', KEYS[3], url)
+    redis.call('DEL', 'cache:' .. url, 'meta:' .. url)
+    release(url)
+end
+return redis.call('ZCARD', KEYS[3])
+""")
+
+# Read the cached body (via KEYS[1]) and recorded failure (KEYS[2]) of
+# a URL (ARGV[1]), marking it used at ARGV[2] in the LRU set if given
+_READ_PAGE = r.register_script("""
+if ARGV[2] then
+    redis.call('ZADD', KEYS[3], 'XX', ARGV[2], ARGV[1])
+end
+local body = false
+local digest = redis.call('GET', KEYS[1])
+if digest then
+    body = redis.call('GET', 'body:' .. digest)
+end
+return {body, redis.call('HGETALL', KEYS[2])}
+""")
+
+def freshness_lifetime(response: requests.Response) -> int:
+    """
+    Derive how long a response may be cached from its headers.
+
+    Args:
+        response (requests.Response): The response to inspect.
+
+    Returns:
+        int: The lifetime in seconds (0 when it must not be cached),
+        capped at REVALIDATION_WINDOW.
+    """
+    cache_control = response.headers.get("Cache-Control", "").lower()
+    if "no-store" in cache_control or "no-cache" in cache_control:
+        return 0
+
+    # Cache-Control: max-age takes precedence over Expires
+    max_age = re.search(r"max-age=(\d+)", cache_control)
+    if max_age:
+        return min(int(max_age.group(1)), REVALIDATION_WINDOW)
+
+    expires = response.headers.get("Expires")
+    if expires:
+        try:
+            expires_at = parsedate_to_datetime(expires)
+        except (TypeError, ValueError):
+            # An invalid Expires date means already expired
+            return 0
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        remaining = expires_at - datetime.now(timezone.utc)
+        return min(max(0, int(remaining.total_seconds())),
+                   REVALIDATION_WINDOW)
+
+    return CACHE_EXPIRATION_TIME
+
+def response_validators(response: requests.Response) -> dict:
+    """
+    Collect the validators a response can be revalidated with.
+
+    Args:
+        response (requests.Response): The response to inspect.
+
+    Returns:
+        dict: Its ETag and Last-Modified headers, when present.
+    """
+    validators = {}
+    if response.headers.get("ETag"):
+        validators["etag"] = response.headers["ETag"]
+    if response.headers.get("Last-Modified"):
+        validators["last_modified"] = response.headers["Last-Modified"]
+    return validators
+
+@lru_cache(maxsize=MAX_CACHED_PAGES)
+def normalize_url(url: str) -> str:
+    """
+    Normalize a URL so equivalent spellings share one cache entry.
+
+    The scheme and host are lowercased, query parameters are sorted by
+    name (repeated names keep their order) and the fragment (never sent
+    to the server) is dropped. Results are
+    memoized, since every call of get_page normalizes its URL twice.
+
+    Args:
+        url (str): The URL to normalize.
+
+    Returns:
+        str: The normalized URL used to build Redis keys.
+    """
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True),
+                             key=lambda param: param[0]))
+    # Only the host is case-insensitive, not the user information
+    userinfo, at, host = parts.netloc.rpartition('@')
+    return urlunsplit((parts.scheme.lower(), userinfo + at + host.lower(),
+                       parts.path, query, ''))
+
+def compress(content: str) -> bytes:
+    """
+    Encode page content as gzip-compressed UTF-8 for storage in Redis.
+
+    Args:
+        content (str): The page content.
+
+    Returns:
+        bytes: The compressed content.
+    """
+    # Level 6 is far cheaper than the default 9 at nearly the same ratio
+    return gzip.compress(content.encode('utf-8'), compresslevel=6)
+
+def decompress(data: bytes) -> str:
+    """
+    Decode page content stored with compress.
+
+    Args:
+        data (bytes): The compressed content.
+
+    Returns:
+        str: The page content.
+    """
+    return gzip.decompress(data).decode('utf-8')
+
+def store_body(pipe: redis.client.Pipeline, key: str, content: str) -> str:
+    """
+    Queue page content for storage under its BLAKE2b digest, so URLs
+    returning the same body share a single compressed copy.
+
+    The URL's reference to its previous body, if any, is released.
+
+    Args:
+        pipe (redis.client.Pipeline): The pipeline to queue commands on.
+        key (str): The normalized URL the content belongs to.
+        content (str): The page content.
+
+    Returns:
+        str: The digest the content is stored under.
+    """
+    digest = hashlib.blake2b(content.encode('utf-8'),
+                             digest_size=16).hexdigest()
+    _STORE_BODY(keys=[BODY_URLS_KEY, BODY_REFS_KEY],
+                args=[key, digest, compress(content)], client=pipe)
+    return digest
+
+def lookup_page(key: str, touch: bool = False) -> Tuple[Optional[str], dict]:
+    """
+    Read the cached content and any recorded failure of a URL in a
+    single round trip. The script is called on the client rather than
+    in a pipeline, which would check that it is loaded first.
+
+    Args:
+        key (str): The normalized URL to look up.
+        touch (bool): Whether to mark the URL as recently used.
+
+    Returns:
+        Tuple[Optional[str], dict]: The page content (None if not
+        cached) and the error hash (empty if none was recorded).
+    """
+    args = [key, time.time()] if touch else [key]
+    body, error = _READ_PAGE(keys=[f"cache:{key}", f"error:{key}", LRU_KEY],
+                             args=args)
+    content = decompress(body) if body else None
+    return content, dict(zip(error[::2], error[1::2]))
+
+def evict_pages() -> None:
+    """
+    Evict pages once more than MAX_CACHED_PAGES URLs are cached.
+
+    Victims are picked v-LRU style: among the least recently used 10%
+    of pages, the ones with the lowest hit ratio (accesses per second
+    since last use) go first, so popular pages survive a burst of
+    one-off URLs.
+    """
+    # Drop URLs not touched for a whole REVALIDATION_WINDOW: no key of
+    # theirs can outlive it, so only already-expired entries are removed
+    size = _TRIM_PAGES(keys=[BODY_URLS_KEY, BODY_REFS_KEY, LRU_KEY],
+                       args=[f"({time.time() - REVALIDATION_WINDOW}"])
+    excess = size - MAX_CACHED_PAGES
+    if excess <= 0:
+        return
+
+    # Candidates are the oldest 10% by recency (at least the excess)
+    candidates = r.zrange(LRU_KEY, 0, max(excess, size // 10) - 1,
+                          withscores=True)
+    urls = [url.decode('utf-8') for url, _ in candidates]
+    counts = r.mget([f"count:{url}" for url in urls])
+    now = time.time()
+
+    def hit_ratio(i: int) -> float:
+        """Accesses per second since the candidate was last used."""
+        age = max(1.0, now - candidates[i][1])
+        return int(counts[i] or 0) / age
+
+    ranked = sorted(range(len(urls)), key=hit_ratio)
+    victims = [urls[i] for i in ranked[:excess]]
+    _DROP_PAGES(keys=[BODY_URLS_KEY, BODY_REFS_KEY, LRU_KEY], args=victims)
+
+def cache_error(key: str, error: requests.RequestException) -> None:
+    """
+    Remember a failed fetch so retries within its short lifetime do
+    not hit the upstream server again.
+
+    Args:
+        key (str): The normalized URL that failed.
+        error (requests.RequestException): The error raised by the fetch.
+    """
+    status = error.response.status_code if error.response is not None else 0
+    ttl = NEGATIVE_CACHE_TIME_NOT_FOUND if status == 404 \
+        else NEGATIVE_CACHE_TIME
+    error_key = f"error:{key}"
+    pipe = r.pipeline()
+    pipe.hset(error_key, mapping={"type": type(error).__name__,
+                                  "status": status,
+                                  "message": str(error)})
+    pipe.expire(error_key, ttl)
+    pipe.execute()
+
+def raise_cached_error(error: dict) -> None:
+    """
+    Raise a failure recorded by cache_error again, with the same
+    exception type and HTTP status as the original.
+
+    Args:
+        error (dict): The error hash read from Redis.
+
+    Raises:
+        requests.RequestException: The recorded failure.
+    """
+    error_type = getattr(requests.exceptions,
+                         error[b"type"].decode('utf-8'), None)
+    if not (isinstance(error_type, type)
+            and issubclass(error_type, requests.RequestException)):
+        error_type = requests.RequestException
+    response = None
+    if int(error[b"status"]):
+        response = requests.Response()
+        response.status_code = int(error[b"status"])
+    raise error_type(error[b"message"].decode('utf-8'), response=response)
+
 def count_calls(method: Callable) -> Callable:
     """
     A decorator to count how many
@@ -22,46 +357,186 @@ def count_calls(method: Callable) -> Callable:
         that increments the call count.
     """
     @wraps(method)
-    def wrapper(*args, **kwargs):
-        url = args[0]
-        key = f"count:{url}"
+    def wrapper(url: str) -> str:
         # Increment the count in Redis for the specific URL
-        count = r.incr(key)
+        r.incr(f"count:{normalize_url(url)}")
         # Execute the original method and return its output
-        return method(*args, **kwargs)
+        return method(url)
 
     return wrapper
 
 @count_calls
 def get_page(url: str) -> str:
     """
-    Fetches the HTML content from a given URL
-    and caches it in Redis with an expiration time.
+    Fetches the HTML content from a given URL and caches it in Redis
+    for as long as the server allows (10 seconds by default).
+
+    Once the cached copy expires, the page is revalidated with its ETag
+    or Last-Modified date so an unchanged page is not downloaded again.
+    Concurrent misses for the same URL are coalesced into one fetch,
+    and failed fetches are remembered briefly (60 seconds for a 404,
+    2 seconds otherwise) so retries do not hit the server again; they
+    raise the same exception type as the original failure.
+
+    Args:
+        url (str): The URL to fetch.
+
+    Returns:
+        str: The HTML content of the page.
+    """
+    key = normalize_url(url)
+
+    # Check if the content is already cached in Redis, marking it as
+    # recently used in the same round trip
+    cached_content, cached_error = lookup_page(key, touch=True)
+    if cached_content is not None:
+        return cached_content
+    if cached_error:
+        # The page failed recently: fail again without refetching it
+        raise_cached_error(cached_error)
+
+    # Only one caller fetches a missing page; the others wait for its
+    # result, or for the lock if the page turns out not to be cacheable.
+    # The lock is renewed from another thread, so its token is shared.
+    lock = r.lock(f"lock:{key}", timeout=FETCH_LOCK_TIMEOUT,
+                  thread_local=False)
+    while not lock.acquire(blocking=False):
+        time.sleep(FETCH_POLL_INTERVAL)
+        cached_content, cached_error = lookup_page(key)
+        if cached_content is not None:
+            return cached_content
+        if cached_error:
+            raise_cached_error(cached_error)
+
+    fetched = Event()
+
+    def renew_lock() -> None:
+        """Keep the lock alive until the fetch below is over."""
+        while not fetched.wait(FETCH_LOCK_TIMEOUT / 3):
+            try:
+                lock.reacquire()
+            except redis.exceptions.LockError:
+                return
+
+    Thread(target=renew_lock, daemon=True).start()
+    try:
+        # Another caller may have filled the cache or recorded a failure
+        # before we got here
+        cached_content, cached_error = lookup_page(key)
+        if cached_content is not None:
+            return cached_content
+        if cached_error:
+            raise_cached_error(cached_error)
+        return fetch_page(url, key)
+    finally:
+        fetched.set()
+        try:
+            lock.release()
+        except redis.exceptions.LockError:
+            # The lock timed out and may already belong to someone else
+            pass
+
+def fetch_page(url: str, key: str) -> str:
+    """
+    Downloads a page and stores it in the cache, revalidating the last
+    known copy when its ETag or Last-Modified date is available.
 
     Args:
         url (str): The URL to fetch.
+        key (str): The normalized URL the page is cached under.
 
     Returns:
         str: The HTML content of the page.
     """
-    cache_key = f"cache:{url}"
-    count_key = f"count:{url}"
+    cache_key = f"cache:{key}"
+    meta_key = f"meta:{key}"
+
+    # Revalidate the last known body instead of downloading it again
+    meta = r.hgetall(meta_key)
+    known_content = None
+    if b"digest" in meta:
+        body = r.get(f"body:{meta[b'digest'].decode('utf-8')}")
+        known_content = decompress(body) if body else None
+    headers = {}
+    if known_content is not None:
+        if b"etag" in meta:
+            headers["If-None-Match"] = meta[b"etag"].decode('utf-8')
+        if b"last_modified" in meta:
+            headers["If-Modified-Since"] = \
+                meta[b"last_modified"].decode('utf-8')
 
-    # Check if the content is already cached in Redis
-    cached_content = r.get(cache_key)
-    if cached_content:
-        # If cached, decode and return the content
-        return cached_content.decode('utf-8')
+    # If not cached, fetch the content over the pooled session
+    try:
+        response = _SESSION.get(url, headers=headers, timeout=FETCH_TIMEOUT)
+        response.raise_for_status()
+    except requests.RequestException as error:
+        # HTTP errors, exhausted retries, timeouts and refused connections
+        cache_error(key, error)
+        raise
+    ttl = freshness_lifetime(response)
+
+    if response.status_code == 304 and known_content is not None:
+        # Unchanged upstream: refresh the cached copy without a body
+        digest = meta[b"digest"]
+        pipe = r.pipeline()
+        if ttl > 0:
+            pipe.setex(cache_key, ttl, digest)
+        # A 304 carries the current validators (RFC 9111, section 4.3.4)
+        validators = response_validators(response)
+        if validators:
+            pipe.hset(meta_key, mapping=validators)
+        pipe.expire(meta_key, REVALIDATION_WINDOW)
+        pipe.zadd(LRU_KEY, {key: time.time()})
+        pipe.execute()
+        evict_pages()
+        return known_content
 
-    # If not cached, fetch the content using requests
-    response = requests.get(url)
     html_content = response.text
+    pipe = r.pipeline()
+
+    # Keep the validators so the next miss can be a conditional request
+    validators = response_validators(response)
+    no_store = "no-store" in response.headers.get("Cache-Control", "").lower()
+    keep_validators = bool(validators) and not no_store
+
+    # Store the body once, shared with any URL returning the same content
+    if ttl > 0 or keep_validators:
+        digest = store_body(pipe, key, html_content)
+
+    # Cache the content in Redis for its freshness lifetime
+    if ttl > 0:
+        pipe.setex(cache_key, ttl, digest)
 
-    # Cache the content in Redis with a 10-second expiration time
-    r.setex(cache_key, 10, html_content)
+    pipe.delete(meta_key)
+    if keep_validators:
+        validators["digest"] = digest
+        pipe.hset(meta_key, mapping=validators)
+        pipe.expire(meta_key, REVALIDATION_WINDOW)
+    if ttl > 0 or keep_validators:
+        pipe.zadd(LRU_KEY, {key: time.time()})
+    else:
+        # Nothing is kept for this page: release its previous body too
+        _DROP_PAGES(keys=[BODY_URLS_KEY, BODY_REFS_KEY, LRU_KEY], args=[key],
+                    client=pipe)
+    pipe.execute()
+    evict_pages()
 
     return html_content
 
+def get_pages(urls: Iterable[str]) -> List[str]:
+    """
+    Fetches several pages concurrently through get_page, so cache
+    misses overlap instead of being fetched one after the other.
+
+    Args:
+        urls (Iterable[str]): The URLs to fetch.
+
+    Returns:
+        List[str]: The HTML content of each page, in the same order.
+    """
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_FETCHES) as executor:
+        return list(executor.map(get_page, urls))
+
 def get_count(url: str) -> int:
     """
     Get the number of times a URL has been accessed.
@@ -72,7 +547,7 @@ def get_count(url: str) -> int:
     Returns:
         int: The number of times the URL has been accessed.
     """
-    count = r.get(f"count:{url}")
+    count = r.get(f"count:{normalize_url(url)}")
     return int(count) if count else 0
 
 def reset_count(url: str) -> None:
@@ -82,13 +557,37 @@ def reset_count(url: str) -> None:
     Args:
         url (str): The URL to reset.
     """
-    r.delete(f"count:{url}")
+    r.delete(f"count:{normalize_url(url)}")
 
 if __name__ == "__main__":
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from threading import Thread
+
+    class CacheableHandler(BaseHTTPRequestHandler):
+        """Serves a small page that may be cached for 2 seconds."""
+        served = 0
+
+        def do_GET(self) -> None:
+            CacheableHandler.served += 1
+            body = b"<html>cacheable</html>"
+            self.send_response(200)
+            self.send_header("Cache-Control", "max-age=2")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args) -> None:
+            pass
+
+    # Serve a page known to be cacheable instead of relying on a live site
+    server = HTTPServer(("127.0.0.1", 0), CacheableHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+
     # Clear any existing data
     r.flushall()
 
-    url = "http://google.com"
+    url = f"http://127.0.0.1:{server.server_port}/"
+    cache_key = f"cache:{normalize_url(url)}"
 
     # Test 1: Initial count should be 0
     initial_count = get_count(url)
@@ -104,14 +603,65 @@ if __name__ == "__main__":
     count_after_second = get_count(url)
     assert count_after_second == 2, f"Expected count 2, got {count_after_second}"
 
-    # Test 4: Content should be cached for 10 seconds
-    import time
-    cached_content = r.get(f"cache:{url}")
-    assert cached_content is not None, "Content should be cached"
+    # Test 4: Content should be cached for its max-age
+    assert r.get(cache_key) is not None, "Content should be cached"
+    ttl = r.ttl(cache_key)
+    assert 0 < ttl <= 2, f"Expected a TTL of at most 2 seconds, got {ttl}"
 
-    # Test 5: Cache should expire after 10 seconds
-    time.sleep(11)
-    expired_content = r.get(f"cache:{url}")
+    # Test 5: Cache should expire once its lifetime has elapsed
+    time.sleep(ttl + 1)
+    expired_content = r.get(cache_key)
     assert expired_content is None, "Cache should have expired"
 
+    # Test 6: Lifetimes should follow the response headers
+    def lifetime(**headers: str) -> int:
+        """Freshness lifetime of a response carrying the given headers."""
+        response = requests.Response()
+        response.headers.update({name.replace('_', '-'): value
+                                 for name, value in headers.items()})
+        return freshness_lifetime(response)
+
+    assert lifetime() == CACHE_EXPIRATION_TIME
+    assert lifetime(Cache_Control="public, max-age=60") == 60
+    assert lifetime(Cache_Control="max-age=86400") == REVALIDATION_WINDOW
+    assert lifetime(Cache_Control="max-age=60",
+                    Expires="Thu, 01 Jan 1970 00:00:00 GMT") == 60
+    assert lifetime(Cache_Control="no-store, max-age=60") == 0
+    assert lifetime(Expires="Thu, 01 Jan 1970 00:00:00 GMT") == 0
+    assert lifetime(Expires="not a date") == 0
+    in_a_minute = datetime.now(timezone.utc).timestamp() + 60
+    expires = datetime.fromtimestamp(in_a_minute, timezone.utc)
+    assert 58 <= lifetime(
+        Expires=expires.strftime("%a, %d %b %Y %H:%M:%S GMT")) <= 60
+
+    # Test 7: URLs returning the same body should share one stored copy
+    r.flushall()
+    get_page(url)
+    get_page(f"{url}?copy=1")
+    assert len(r.keys("body:*")) == 1, "Identical bodies should be shared"
+    digest = r.hget(BODY_URLS_KEY, normalize_url(url))
+    body_key = f"body:{digest.decode('utf-8')}"
+    refs = int(r.hget(BODY_REFS_KEY, digest))
+    assert refs == 2, f"Expected 2 references, got {refs}"
+
+    # Test 8: A body lost to Redis eviction should be stored again
+    r.delete(body_key)
+    served = CacheableHandler.served
+    assert get_page(url) == "<html>cacheable</html>"
+    assert get_page(url) == "<html>cacheable</html>"
+    assert r.exists(body_key), "The missing body should be restored"
+    assert CacheableHandler.served == served + 1, "Expected a single refetch"
+
+    # Test 9: Evicting pages should release their bodies
+    MAX_CACHED_PAGES = 1
+    evict_pages()
+    refs = int(r.hget(BODY_REFS_KEY, digest))
+    assert refs == 1, f"Expected 1 reference, got {refs}"
+    assert r.exists(body_key), "A referenced body should be kept"
+    MAX_CACHED_PAGES = 0
+    evict_pages()
+    assert not r.exists(body_key), "An unreferenced body should be deleted"
+    assert not r.hlen(BODY_REFS_KEY), "No references should remain"
+
+    server.shutdown()
     print("All tests passed!")